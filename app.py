@@ -2,10 +2,10 @@ import uuid
 from fastapi import FastAPI, UploadFile, File, Body, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 import os
-from typing import List
+from typing import List, Optional
 import tempfile
 import shutil
-from clip_sift_search import analyze_images
+from clip_sift_search import analyze_images, PairVerdictCache
 from fastapi.responses import StreamingResponse, JSONResponse
 import json
 import asyncio
@@ -38,6 +38,9 @@ progress_queue = queue.Queue()
 # Dictionary to track user sessions (IP address -> list of session IDs)
 user_sessions = {}
 
+# Pair verdicts shared across sessions, persisted outside the upload directories
+pair_cache = PairVerdictCache()
+
 # Ensure base upload directory exists
 os.makedirs(UPLOAD_BASE_DIR, exist_ok=True)
 
@@ -81,10 +84,18 @@ def cleanup_old_uploads():
     except Exception as e:
         print(f"Error during old uploads cleanup: {str(e)}")
 
-def analyze_files_with_progress(folder_path, model_name):
-    """Run analysis in a separate thread and put progress updates in the queue"""
+def analyze_files_with_progress(folder_path, model_name, max_duplicates=None, min_clip_score=None):
+    """Run analysis in a separate thread and put progress updates and verified pairs in the queue"""
     try:
-        results = analyze_images(folder_path, progress_callback=lambda p: progress_queue.put({"progress": p}), model_name=model_name)
+        results = analyze_images(
+            folder_path,
+            progress_callback=lambda p: progress_queue.put({"progress": p}),
+            model_name=model_name,
+            pair_cache=pair_cache,
+            pair_callback=lambda pair: progress_queue.put({"pair": pair}),
+            max_duplicates=max_duplicates,
+            min_clip_score=min_clip_score
+        )
         progress_queue.put({"done": True, "results": results})
     except Exception as e:
         progress_queue.put({"error": str(e)})
@@ -164,6 +175,8 @@ async def upload_files(
 
 class AnalyzeRequest(BaseModel):
     model_name: str = "ViT-B/32"
+    max_duplicates: Optional[int] = None  # Stop after this many confirmed duplicate file pairs (identical copies count individually)
+    min_clip_score: Optional[float] = None  # Stop once candidates fall below this CLIP score
 
 @app.post("/api/analyze/{session_id}")
 async def analyze_session(
@@ -179,6 +192,18 @@ async def analyze_session(
                 detail=f"Invalid model name. Must be one of: {', '.join(allowed_models)}"
             )
 
+        # Validate early-termination policy
+        if request.max_duplicates is not None and request.max_duplicates < 1:
+            raise HTTPException(
+                status_code=400,
+                detail="max_duplicates must be at least 1"
+            )
+        if request.min_clip_score is not None and not -1.0 <= request.min_clip_score <= 1.0:
+            raise HTTPException(
+                status_code=400,
+                detail="min_clip_score must be between -1 and 1"
+            )
+
         user_upload_dir = os.path.join(UPLOAD_BASE_DIR, session_id)
         if not os.path.exists(user_upload_dir):
             raise HTTPException(
@@ -204,7 +229,7 @@ async def analyze_session(
         # Start analysis in a separate thread
         thread = threading.Thread(
             target=analyze_files_with_progress,
-            args=(user_upload_dir, request.model_name)
+            args=(user_upload_dir, request.model_name, request.max_duplicates, request.min_clip_score)
         )
         thread.start()
         return {"message": "Analysis started"}
@@ -271,6 +296,11 @@ async def progress_stream():
                         "data": json.dumps({"error": data["error"]})
                     }
                     break
+                elif "pair" in data:
+                    yield {
+                        "event": "pair",
+                        "data": json.dumps(data["pair"])
+                    }
                 elif "done" in data:
                     yield {
                         "event": "complete",
@@ -282,7 +312,8 @@ async def progress_stream():
                         "event": "progress",
                         "data": json.dumps(data)
                     }
-            await asyncio.sleep(0.1)  # Small delay to prevent CPU overload
+            else:
+                await asyncio.sleep(0.1)  # Small delay to prevent CPU overload
 
     return EventSourceResponse(event_generator())
 
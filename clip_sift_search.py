@@ -6,14 +6,17 @@ import torch
 import clip
 from PIL import Image, UnidentifiedImageError
 import cv2
-from typing import List, Tuple, Optional
-from itertools import combinations
+from typing import Iterator, List, Tuple, Optional
+from itertools import combinations, product
 import tempfile
 from pdf2image import convert_from_path
 import shutil
 import time
 import json
 import sys
+import hashlib
+import threading
+from collections import OrderedDict
 
 #########################################
 #           Configuration               #
@@ -25,7 +28,11 @@ DEFAULT_TOP_K = 50  # Changed to 50 for more pairs
 DEFAULT_INITIAL_CLIP_TOP = 100  # Increased to get more candidates
 SIFT_RATIO_THRESHOLD = 0.75
 RANSAC_REPROJ_THRESHOLD = 5.0
+DUPLICATE_INLIER_THRESHOLD = 100  # Minimum number of inliers for duplicates
 SUPPORTED_FORMATS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.tif', '.pdf')
+PAIR_CACHE_FILE = os.path.join("cache", "pair_verdicts.json")
+PAIR_CACHE_MAX_ENTRIES = 100000  # LRU bound on cached pair verdicts
+PAIR_CACHE_TTL_SECONDS = 7 * 24 * 3600  # Drop verdicts older than a week
 
 #########################################
 #        Core Functions                 #
@@ -33,6 +40,7 @@ SUPPORTED_FORMATS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.tif', '.pdf')
 
 class ImageComparator:
     def __init__(self, clip_model_name=CLIP_MODEL_NAME):
+        self.clip_model_name = clip_model_name
         self.model, self.preprocess = clip.load(clip_model_name, device=DEVICE)
         self.model.eval()
         self.sift = cv2.SIFT_create()
@@ -117,6 +125,136 @@ class ImageComparator:
         )
         return H, np.sum(mask) if mask is not None else 0
 
+    def verify_pair(self, cv_image1: np.ndarray, cv_image2: np.ndarray) -> int:
+        """Count RANSAC inliers between two OpenCV images (0 if no features)"""
+        kp1, des1 = self.extract_sift_features(cv_image1)
+        kp2, des2 = self.extract_sift_features(cv_image2)
+
+        # Skip if no features detected
+        if des1 is None or des2 is None:
+            return 0
+
+        # Feature matching and homography estimation
+        matches = self.match_features(des1, des2)
+        _, inliers = self.estimate_homography(kp1, kp2, matches)
+        return int(inliers)
+
+class PairVerdictCache:
+    """
+    Cache of SIFT/CLIP verdicts for image pairs, keyed by content hashes
+
+    Entries are evicted least-recently-used once max_entries is exceeded and
+    expire after ttl_seconds. The cache is persisted to a JSON file so verdicts
+    survive across upload sessions and server restarts.
+    """
+
+    def __init__(self, cache_file: Optional[str] = PAIR_CACHE_FILE,
+                 max_entries: int = PAIR_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = PAIR_CACHE_TTL_SECONDS):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False  # Set when entries change, cleared once they are saved
+        self.load()
+
+    @staticmethod
+    def make_key(hash1: str, hash2: str, model_name: str) -> str:
+        """Build an order-independent key from two content hashes and matcher parameters"""
+        h1, h2 = sorted((hash1, hash2))
+        return f"{h1}:{h2}:{model_name}:{SIFT_RATIO_THRESHOLD}:{RANSAC_REPROJ_THRESHOLD}"
+
+    def get(self, key: str) -> Optional[Tuple[int, float]]:
+        """Return (inliers, clip_score) for a cached pair, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry['timestamp'] > self.ttl_seconds:
+                del self._entries[key]
+                self._dirty = True
+                return None
+            self._entries.move_to_end(key)
+            return entry['inliers'], entry['clip_score']
+
+    def put(self, key: str, inliers: int, clip_score: float):
+        """Store a pair verdict, evicting the least recently used entries if needed"""
+        with self._lock:
+            self._entries[key] = {
+                'inliers': int(inliers),
+                'clip_score': float(clip_score),
+                'timestamp': time.time()
+            }
+            self._dirty = True
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def load(self):
+        """Load cached verdicts from the backing file, skipping expired entries"""
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r') as f:
+                data = json.load(f)
+            now = time.time()
+            with self._lock:
+                for key, entry in data.items():
+                    if now - entry['timestamp'] <= self.ttl_seconds:
+                        self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            print(f"Loaded {len(self._entries)} cached pair verdicts from {self.cache_file}")
+        except Exception as e:
+            print(f"⚠️ Failed to load pair cache {self.cache_file}: {str(e)}")
+
+    def save(self):
+        """Write cached verdicts to the backing file atomically, if anything changed"""
+        if not self.cache_file:
+            return
+        try:
+            cache_dir = os.path.dirname(self.cache_file)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            # Serialize concurrent saves so they cannot interleave writes or replaces
+            with self._save_lock:
+                with self._lock:
+                    if not self._dirty:
+                        return
+                    data = dict(self._entries)
+                    self._dirty = False
+                fd, tmp_path = tempfile.mkstemp(dir=cache_dir or None, suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w') as f:
+                        json.dump(data, f)
+                    os.replace(tmp_path, self.cache_file)
+                except Exception:
+                    with self._lock:
+                        self._dirty = True
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+        except Exception as e:
+            print(f"⚠️ Failed to save pair cache {self.cache_file}: {str(e)}")
+
+    def save_in_background(self):
+        """Save cached verdicts on a background thread so callers don't wait on disk I/O"""
+        threading.Thread(target=self.save, daemon=True).start()
+
+def compute_file_hash(path: str) -> Optional[str]:
+    """Compute the SHA-256 hash of a file's contents"""
+    try:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    except OSError as e:
+        print(f"⚠️ Failed to hash {path}: {str(e)}")
+        return None
+
 def convert_pdf_to_images(pdf_path: str, temp_dir: str) -> List[str]:
     """
     Convert PDF file to a list of images
@@ -148,12 +286,98 @@ def convert_pdf_to_images(pdf_path: str, temp_dir: str) -> List[str]:
 #        Search Pipeline                #
 #########################################
 
+def iter_verified_pairs(
+    clip_candidates: List[Tuple[str, str, float]],
+    comparator: ImageComparator,
+    image_cache: dict,
+    file_hashes: dict,
+    hash_groups: dict,
+    progress_callback=None,
+    pair_cache: Optional[PairVerdictCache] = None,
+    max_duplicates: Optional[int] = None,
+    min_clip_score: Optional[float] = None
+) -> Iterator[Tuple[Tuple[str, str], int, float]]:
+    """
+    Verify CLIP candidates with SIFT and yield each verified pair as soon as it is known
+    
+    Args:
+        clip_candidates: (img1, img2, clip_score) tuples sorted by descending CLIP score
+        comparator: Initialized ImageComparator instance
+        image_cache: Loaded images keyed by representative path
+        file_hashes: Content hash of each image path (None if hashing failed)
+        hash_groups: Paths sharing each content hash (or a lone unhashed path), representative first
+        progress_callback: Callback function for progress updates
+        pair_cache: Optional cache of pair verdicts shared across sessions
+        max_duplicates: Stop once this many duplicate file pairs have been confirmed
+        min_clip_score: Stop once candidates fall below this CLIP score
+    
+    Yields:
+        ((img1, img2), inliers, clip_score) for every verified pair
+    """
+    pairs_processed = 0
+    cache_hits = 0
+    duplicates_found = 0
+    
+    for img1_path, img2_path, clip_score in clip_candidates:
+        # Candidates are sorted, so every remaining pair is below the floor too
+        if min_clip_score is not None and clip_score < min_clip_score:
+            print(f"⏹️ Stopping early: CLIP score {clip_score:.4f} below floor {min_clip_score}")
+            break
+        
+        # Use cached images
+        img1_data = image_cache.get(img1_path)
+        img2_data = image_cache.get(img2_path)
+        
+        if img1_data is not None and img2_data is not None:
+            # Answer known pairs from the verdict cache (unhashed files are never cached)
+            hash1 = file_hashes[img1_path]
+            hash2 = file_hashes[img2_path]
+            cacheable = pair_cache is not None and hash1 is not None and hash2 is not None
+            cache_key = PairVerdictCache.make_key(hash1, hash2, comparator.clip_model_name) if cacheable else None
+            cached = pair_cache.get(cache_key) if cacheable else None
+            if cached is not None:
+                inliers, clip_score = cached
+                cache_hits += 1
+            else:
+                # Identical copies are verified once, representative against itself
+                inliers = comparator.verify_pair(img1_data['cv_image'], img2_data['cv_image'])
+                if cacheable:
+                    pair_cache.put(cache_key, inliers, clip_score)
+            
+            # Expand the verdict back to every file sharing these contents
+            if img1_path == img2_path:
+                member_pairs = combinations(hash_groups[hash1], 2)
+            else:
+                member_pairs = product(hash_groups[hash1 or img1_path], hash_groups[hash2 or img2_path])
+            for member1, member2 in member_pairs:
+                yield (member1, member2), inliers, clip_score
+                if inliers >= DUPLICATE_INLIER_THRESHOLD:
+                    duplicates_found += 1
+                    if max_duplicates is not None and duplicates_found >= max_duplicates:
+                        print(f"⏹️ Stopping early: {duplicates_found} duplicate pairs confirmed")
+                        return
+        
+        # Update progress for SIFT phase
+        pairs_processed += 1
+        if pairs_processed % 5 == 0 or pairs_processed == len(clip_candidates):
+            current_progress = min(100, int((pairs_processed / len(clip_candidates)) * 100))
+            print(f"SIFT Progress: {pairs_processed}/{len(clip_candidates)} pairs ({current_progress}%)")
+            if progress_callback:
+                progress_callback(current_progress)
+    
+    if pair_cache is not None:
+        print(f"Pair cache: {cache_hits}/{pairs_processed} candidates answered from cache")
+
 def find_duplicate_images(
     folder_path: str,
     comparator: ImageComparator,
     top_k: int = DEFAULT_TOP_K,
     initial_clip_top: int = DEFAULT_INITIAL_CLIP_TOP,
-    progress_callback=None
+    progress_callback=None,
+    pair_cache: Optional[PairVerdictCache] = None,
+    pair_callback=None,
+    max_duplicates: Optional[int] = None,
+    min_clip_score: Optional[float] = None
 ) -> Tuple[List[Tuple[Tuple[str, str], int, float]], int]:
     """
     Find potential duplicate images within a folder using CLIP and SIFT
@@ -164,6 +388,10 @@ def find_duplicate_images(
         top_k: Number of final results to return
         initial_clip_top: Number of CLIP candidates for SIFT verification
         progress_callback: Callback function for progress updates
+        pair_cache: Optional cache of pair verdicts shared across sessions
+        pair_callback: Callback receiving each verified pair as soon as it is known
+        max_duplicates: Stop verification once this many duplicate pairs are confirmed
+        min_clip_score: Stop verification once candidates fall below this CLIP score
     
     Returns:
         Tuple of (verified_results, total_pairs)
@@ -196,10 +424,23 @@ def find_duplicate_images(
 
         print(f"🔍 Found {len(images)} images to compare (including PDF pages)")
         
-        # Extract CLIP features for all images
+        # Collapse byte-identical files to a single representative
+        print("🧮 Hashing files to collapse identical uploads...")
+        file_hashes = {}
+        hash_groups = {}  # content hash -> paths, the first path is the representative
+        for img_path in images:
+            file_hash = compute_file_hash(img_path)
+            file_hashes[img_path] = file_hash
+            # Files that cannot be hashed still get compared, as their own singleton group
+            hash_groups.setdefault(file_hash or img_path, []).append(img_path)
+        representatives = [paths[0] for paths in hash_groups.values()]
+        if len(representatives) < len(images):
+            print(f"♻️ Collapsed {len(images)} files into {len(representatives)} unique images")
+        
+        # Extract CLIP features for all unique images
         print("📊 Extracting CLIP features...")
         image_features = {}
-        for img_path in images:
+        for img_path in representatives:
             # Load image once and cache it
             img = comparator.load_image(img_path)
             if img is not None:
@@ -216,16 +457,20 @@ def find_duplicate_images(
                 except RuntimeError as e:
                     print(f"🚨 CLIP processing failed for {img_path}: {str(e)}")
         
-        if len(image_features) < 2:
+        # Calculate total possible pairs over all valid files, including identical copies
+        n = sum(len(hash_groups[file_hashes[img_path] or img_path]) for img_path in image_features)
+        if n < 2:
             raise ValueError("Need at least 2 valid images to compare after processing")
-        
-        # Calculate total possible pairs and total work units
-        n = len(image_features)
         total_pairs = (n * (n - 1)) // 2
         
-        # Compare all possible pairs with CLIP first
+        # Compare all unique pairs with CLIP first
         print(f"🔄 Comparing image pairs with CLIP...")
         clip_results = []
+        for img_path in image_features:
+            # Identical copies are compared through their representative
+            if len(hash_groups[file_hashes[img_path] or img_path]) > 1:
+                similarity = float(np.dot(image_features[img_path], image_features[img_path]))
+                clip_results.append((img_path, img_path, similarity))
         for img1_path, img2_path in combinations(image_features.keys(), 2):
             # Calculate CLIP similarity
             similarity = float(np.dot(image_features[img1_path], image_features[img2_path]))
@@ -235,43 +480,31 @@ def find_duplicate_images(
         clip_results.sort(key=lambda x: x[2], reverse=True)
         clip_candidates = clip_results[:initial_clip_top]
         
-        # SIFT verification for top CLIP candidates
+        # SIFT verification for top CLIP candidates, streamed in CLIP-score order
         print(f"🔬 Verifying top {len(clip_candidates)} candidates with SIFT...")
         verified_results = []
-        pairs_processed = 0
+        for result in iter_verified_pairs(
+            clip_candidates, comparator, image_cache, file_hashes, hash_groups,
+            progress_callback=progress_callback,
+            pair_cache=pair_cache,
+            max_duplicates=max_duplicates,
+            min_clip_score=min_clip_score
+        ):
+            verified_results.append(result)
+            if pair_callback:
+                pair_callback(result)
         
-        for img1_path, img2_path, clip_score in clip_candidates:
-            # Use cached images
-            img1_data = image_cache.get(img1_path)
-            img2_data = image_cache.get(img2_path)
-            
-            if img1_data is None or img2_data is None:
-                continue
-            
-            # Extract SIFT features
-            kp1, des1 = comparator.extract_sift_features(img1_data['cv_image'])
-            kp2, des2 = comparator.extract_sift_features(img2_data['cv_image'])
-            
-            # Skip if no features detected
-            if des1 is None or des2 is None:
-                verified_results.append(((img1_path, img2_path), 0, clip_score))
-            else:
-                # Feature matching and homography estimation
-                matches = comparator.match_features(des1, des2)
-                _, inliers = comparator.estimate_homography(kp1, kp2, matches)
-                verified_results.append(((img1_path, img2_path), inliers, clip_score))
-            
-            # Update progress for SIFT phase
-            pairs_processed += 1
-            if pairs_processed % 5 == 0 or pairs_processed == len(clip_candidates):
-                current_progress = min(100, int((pairs_processed / len(clip_candidates)) * 100))
-                print(f"SIFT Progress: {pairs_processed}/{len(clip_candidates)} pairs ({current_progress}%)")
-                if progress_callback:
-                    progress_callback(current_progress)
+        if pair_cache is not None:
+            pair_cache.save_in_background()
         
-        # Sort results: first by inliers (Local Matches), then by CLIP score
-        verified_results.sort(key=lambda x: (x[1], x[2]), reverse=True)
-        return verified_results[:top_k], total_pairs
+        # Sort results: byte-identical copies first, then by inliers (Local Matches), then by CLIP score
+        def is_identical(result):
+            img1, img2 = result[0]
+            return file_hashes[img1] is not None and file_hashes[img1] == file_hashes[img2]
+        verified_results.sort(key=lambda x: (is_identical(x), x[1], x[2]), reverse=True)
+        # Exact copies are the most certain duplicates, so they are never cut by top_k
+        identical_count = sum(1 for result in verified_results if is_identical(result))
+        return verified_results[:max(top_k, identical_count)], total_pairs
         
     except Exception as e:
         print(f"Error in find_duplicate_images: {str(e)}")
@@ -301,9 +534,22 @@ def get_display_name(path: str, folder_path: str) -> str:
         return os.path.join(os.path.relpath(folder_path), pdf_name)
     return os.path.relpath(path, start=os.path.dirname(folder_path))
 
-def analyze_images(folder_path, progress_callback=None, model_name="ViT-B/32"):
+def format_pair_result(result: Tuple[Tuple[str, str], int, float]) -> dict:
+    """Convert a verified pair into the JSON-friendly format used in results"""
+    (img1, img2), inliers, clip_score = result
+    return {
+        'image1': os.path.basename(img1),
+        'image2': os.path.basename(img2),
+        'inliers': int(inliers),
+        'clip_score': float(clip_score),
+        'is_duplicate': bool(inliers >= DUPLICATE_INLIER_THRESHOLD)
+    }
+
+def analyze_images(folder_path, progress_callback=None, model_name="ViT-B/32", pair_cache=None,
+                   pair_callback=None, max_duplicates=None, min_clip_score=None):
     """
     Analyze images in the given folder for duplicates using CLIP and SIFT
+    Verified pairs are passed to pair_callback (formatted like top_pairs) as they are found
     Returns a dictionary with analysis results
     """
     results = {
@@ -322,27 +568,23 @@ def analyze_images(folder_path, progress_callback=None, model_name="ViT-B/32"):
         comparator = ImageComparator(clip_model_name=model_name)
         
         # Get duplicate/similar image pairs using CLIP-SIFT analysis
-        verified_results, total_pairs = find_duplicate_images(folder_path, comparator, progress_callback=progress_callback)
+        verified_results, total_pairs = find_duplicate_images(
+            folder_path, comparator,
+            progress_callback=progress_callback,
+            pair_cache=pair_cache,
+            pair_callback=(lambda result: pair_callback(format_pair_result(result))) if pair_callback else None,
+            max_duplicates=max_duplicates,
+            min_clip_score=min_clip_score
+        )
         
         # Process the results
         if verified_results:
             # Store all verified pairs in top_pairs
-            results['top_pairs'] = [
-                {
-                    'image1': os.path.basename(img1),
-                    'image2': os.path.basename(img2),
-                    'inliers': int(inliers),
-                    'clip_score': float(clip_score)
-                }
-                for (img1, img2), inliers, clip_score in verified_results
-            ]
-            
-            # Group results by similarity threshold
-            duplicate_threshold = 100  # Minimum number of inliers for duplicates
+            results['top_pairs'] = [format_pair_result(result) for result in verified_results]
             
             # Process each pair of images (maintaining the sort order)
             for idx, ((img1, img2), inliers, clip_score) in enumerate(verified_results):
-                if inliers >= duplicate_threshold:
+                if inliers >= DUPLICATE_INLIER_THRESHOLD:
                     # Add to duplicate groups
                     # Check if either image is already in a group
                     added_to_existing = False
@@ -198,6 +198,11 @@ export function FileUpload({
                   style={{ width: `${state.progress}%` }}
                 />
               </div>
+              {state.verifiedPairs && state.verifiedPairs.length > 0 && (
+                <p className="mt-2 text-sm text-gray-600">
+                  {state.verifiedPairs.length} pairs verified, {state.verifiedPairs.filter(pair => pair.is_duplicate).length} likely duplicates so far
+                </p>
+              )}
             </div>
           )}
 
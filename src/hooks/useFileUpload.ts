@@ -1,5 +1,5 @@
 import { useState, useCallback } from 'react';
-import { FileUploadState } from '../types/FileUpload';
+import { FileUploadState, VerifiedPair } from '../types/FileUpload';
 
 interface AnalysisResult {
   duplicate_groups: Array<{
@@ -190,7 +190,7 @@ export function useFileUpload(onAnalysisComplete?: (results: AnalysisResult) =>
       return;
     }
 
-    setState(prev => ({ ...prev, status: 'uploading', progress: 0 }));
+    setState(prev => ({ ...prev, status: 'uploading', progress: 0, verifiedPairs: [] }));
 
     try {
       // Start the analysis
@@ -239,6 +239,14 @@ export function useFileUpload(onAnalysisComplete?: (results: AnalysisResult) =>
         }));
       });
 
+      eventSource.addEventListener('pair', (event: MessageEvent) => {
+        const pair: VerifiedPair = JSON.parse(event.data);
+        setState(prev => ({
+          ...prev,
+          verifiedPairs: [...(prev.verifiedPairs || []), pair]
+        }));
+      });
+
       eventSource.addEventListener('complete', (event: MessageEvent) => {
         const results = JSON.parse(event.data);
         setState(prev => ({
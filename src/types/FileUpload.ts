@@ -1,7 +1,16 @@
+export interface VerifiedPair {
+  image1: string;
+  image2: string;
+  inliers: number;
+  clip_score: number;
+  is_duplicate: boolean;
+}
+
 export interface FileUploadState {
   file: File | null;
   files: File[];
   progress: number;
+  verifiedPairs?: VerifiedPair[];
   status: 'idle' | 'uploading' | 'success' | 'error';
   error?: string;
   result?: string;